@@ -2,31 +2,59 @@
 Database Helper Functions
 
 MongoDB helper functions ready to use in your backend code.
-Import and use these functions in your API endpoints for database operations.
+Clients are created inside the app's lifespan (so Motor binds to the running
+event loop) and handed to endpoints through the get_db / get_cache dependencies.
 """
 
-from pymongo import MongoClient
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorDatabase
+from redis.asyncio import Redis
 from datetime import datetime, timezone
 import os
 from dotenv import load_dotenv
-from typing import Union
+from fastapi import Request
+from typing import Optional, Union
 from pydantic import BaseModel
 
 # Load environment variables from .env file
 load_dotenv()
 
-_client = None
-db = None
-
 database_url = os.getenv("DATABASE_URL")
 database_name = os.getenv("DATABASE_NAME")
 
-if database_url and database_name:
-    _client = MongoClient(database_url)
-    db = _client[database_name]
+# Optional Redis cache for read-heavy endpoints; disabled when REDIS_URL is unset
+redis_url = os.getenv("REDIS_URL")
+
+def connect_db() -> Optional[AsyncIOMotorDatabase]:
+    """Open the Motor client, or return None when the database isn't configured"""
+    if not (database_url and database_name):
+        return None
+    # Keep a warm, bounded pool so bursts reuse connections instead of new TCP/TLS handshakes
+    client = AsyncIOMotorClient(
+        database_url,
+        maxPoolSize=50,
+        minPoolSize=10,
+        waitQueueTimeoutMS=2000,
+        serverSelectionTimeoutMS=3000,
+        retryWrites=True,
+        compressors="zstd",
+    )
+    return client[database_name]
+
+def connect_cache() -> Optional[Redis]:
+    """Open the Redis client, or return None when caching isn't configured"""
+    if not redis_url:
+        return None
+    return Redis.from_url(redis_url)
+
+# FastAPI dependencies
+async def get_db(request: Request) -> Optional[AsyncIOMotorDatabase]:
+    return request.app.state.db
+
+async def get_cache(request: Request) -> Optional[Redis]:
+    return request.app.state.cache
 
 # Helper functions for common database operations
-def create_document(collection_name: str, data: Union[BaseModel, dict]):
+async def create_document(db: Optional[AsyncIOMotorDatabase], collection_name: str, data: Union[BaseModel, dict]):
     """Insert a single document with timestamp"""
     if db is None:
         raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
@@ -40,10 +68,10 @@ def create_document(collection_name: str, data: Union[BaseModel, dict]):
     data_dict['created_at'] = datetime.now(timezone.utc)
     data_dict['updated_at'] = datetime.now(timezone.utc)
 
-    result = db[collection_name].insert_one(data_dict)
+    result = await db[collection_name].insert_one(data_dict)
     return str(result.inserted_id)
 
-def get_documents(collection_name: str, filter_dict: dict = None, limit: int = None):
+async def get_documents(db: Optional[AsyncIOMotorDatabase], collection_name: str, filter_dict: dict = None, limit: int = None):
     """Get documents from collection"""
     if db is None:
         raise Exception("Database not available. Check DATABASE_URL and DATABASE_NAME environment variables.")
@@ -52,4 +80,4 @@ def get_documents(collection_name: str, filter_dict: dict = None, limit: int = N
     if limit:
         cursor = cursor.limit(limit)
     
-    return list(cursor)
+    return await cursor.to_list(length=limit)
@@ -1,14 +1,63 @@
 import os
-from fastapi import FastAPI, HTTPException, Depends
+import re
+import logging
+import asyncio
+import math
+import json
+import hashlib
+import secrets
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+import orjson
+from fastapi import FastAPI, HTTPException, Depends, Response, Header
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from pydantic import BaseModel
 from typing import List, Optional, Dict, Any
 from bson import ObjectId
+from argon2 import PasswordHasher
+from argon2.exceptions import VerificationError, InvalidHashError
+from redis.exceptions import RedisError
+from pymongo.errors import DuplicateKeyError, PyMongoError
 
-from database import db, create_document, get_documents
-from schemas import Product, User, Order
+from database import connect_db, connect_cache, get_db, get_cache, create_document, get_documents
+from schemas import Product, User, Order, CartItem, Email
 
-app = FastAPI(title="Fashion Commerce API")
+def orjson_default(obj: Any):
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    raise TypeError
+
+def dumps(content: Any) -> bytes:
+    return orjson.dumps(content, default=orjson_default, option=orjson.OPT_NON_STR_KEYS)
+
+logger = logging.getLogger(__name__)
+
+class MongoJSONResponse(ORJSONResponse):
+    """ORJSONResponse that also stringifies ObjectId values"""
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Clients are created here so Motor's pool binds to the server's event loop
+    app.state.db = connect_db()
+    app.state.cache = connect_cache()
+    if app.state.db is not None:
+        # Boot even when Mongo is unreachable or an index can't be built; /test reports the state
+        await ensure_indexes(app.state.db)
+        try:
+            await load_categories(app.state.db)
+        except PyMongoError:
+            logger.exception("Could not load product categories")
+    yield
+    if app.state.cache is not None:
+        await app.state.cache.aclose()
+    if app.state.db is not None:
+        app.state.db.client.close()
+
+app = FastAPI(title="Fashion Commerce API", default_response_class=MongoJSONResponse, lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -18,6 +67,8 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+_OID_RE = re.compile(r"^[0-9a-fA-F]{24}$")
+
 class ObjectIdStr(str):
     @classmethod
     def __get_validators__(cls):
@@ -25,10 +76,9 @@ class ObjectIdStr(str):
 
     @classmethod
     def validate(cls, v):
-        try:
-            return str(ObjectId(v))
-        except Exception:
+        if not isinstance(v, str) or not _OID_RE.fullmatch(v):
             raise ValueError("Invalid ObjectId")
+        return v
 
 # -----------------
 # Utility helpers
@@ -37,15 +87,119 @@ class ObjectIdStr(str):
 def to_public(doc: Dict[str, Any]):
     if not doc:
         return doc
-    doc["id"] = str(doc.pop("_id"))
+    doc["id"] = doc.pop("_id")  # ObjectId is stringified by orjson_default
     return doc
 
+# -----------------
+# Catalog cache
+# -----------------
+PRODUCT_LIST_TTL = 120
+PRODUCT_TTL = 300
+PRODUCT_LIST_KEYS = "products:list:keys"
+
+def product_list_key(query: Dict[str, Any]) -> str:
+    digest = hashlib.blake2b(json.dumps(query, sort_keys=True).encode(), digest_size=16).hexdigest()
+    return f"products:list:{digest}"
+
+def product_key(product_id: str) -> str:
+    return f"product:{product_id}"
+
+def json_response(body: bytes) -> Response:
+    return Response(content=body, media_type="application/json")
+
+# The cache is best-effort: Redis errors fall through to Mongo instead of failing the request
+async def cache_get(cache, key: str) -> Optional[bytes]:
+    if cache is None:
+        return None
+    try:
+        return await cache.get(key)
+    except RedisError:
+        return None
+
+async def cache_set(cache, key: str, ttl: int, body: bytes, tag: Optional[str] = None):
+    """Store a body, optionally recording its key in a tag set that expires with it"""
+    if cache is None:
+        return
+    try:
+        async with cache.pipeline(transaction=False) as pipe:
+            pipe.setex(key, ttl, body)
+            if tag:
+                pipe.sadd(tag, key)
+                pipe.expire(tag, ttl)
+            await pipe.execute()
+    except RedisError:
+        pass
+
+async def stream_products(first: Optional[Dict[str, Any]], cursor, key: str, cache):
+    """Write a JSON array from an already-fetched first doc and the rest of the cursor"""
+    # Only buffer the body when there's a cache to fill; otherwise chunks are dropped once sent
+    chunks: Optional[List[bytes]] = [] if cache is not None else None
+    if first is not None:
+        chunk = b"[" + dumps(to_public(first))
+        if chunks is not None:
+            chunks.append(chunk)
+        yield chunk
+        async for doc in cursor:
+            chunk = b"," + dumps(to_public(doc))
+            if chunks is not None:
+                chunks.append(chunk)
+            yield chunk
+    tail = b"]" if first is not None else b"[]"
+    yield tail
+    if chunks is not None:
+        chunks.append(tail)
+        await cache_set(cache, key, PRODUCT_LIST_TTL, b"".join(chunks), tag=PRODUCT_LIST_KEYS)
+
+async def invalidate_products(cache, product_id: Optional[str] = None):
+    """Drop cached listings (tracked in a tag set) and, if given, a single product"""
+    if cache is None:
+        return
+    try:
+        keys = list(await cache.smembers(PRODUCT_LIST_KEYS))
+        keys.append(PRODUCT_LIST_KEYS)
+        if product_id:
+            keys.append(product_key(product_id))
+        await cache.unlink(*keys)
+    except RedisError:
+        # Entries we couldn't drop still age out on their TTL
+        pass
+
+async def ensure_indexes(db):
+    """Build all indexes concurrently, logging (not raising) any that fail"""
+    results = await asyncio.gather(
+        # Login and signup look users up by email
+        db.user.create_index("email", unique=True, name="user_email"),
+        # Full-text search for the catalog listing (replaces per-document $regex scans)
+        db.product.create_index([("title", "text"), ("description", "text"), ("tags", "text")], name="product_text"),
+        # Listing filters: equality keys first, then the price range. Partial on is_active
+        # since the storefront never lists inactive products. The trailing title key doesn't
+        # help filtering or sorting and the current projection isn't covered (it returns
+        # images, rating and _id); it's kept only for a future covered listing projection.
+        db.product.create_index(
+            [("is_active", 1), ("category", 1), ("price", 1), ("title", 1)],
+            name="product_listing",
+            partialFilterExpression={"is_active": True},
+        ),
+        db.product.create_index(
+            [("is_active", 1), ("variants.size", 1), ("variants.color", 1)],
+            name="product_active_variant",
+            partialFilterExpression={"is_active": True},
+        ),
+        # Order history, newest first, by account or by guest email
+        db.order.create_index([("user_id", 1), ("created_at", -1)], name="order_user_recent"),
+        db.order.create_index("email", name="order_email"),
+        return_exceptions=True,
+    )
+    for result in results:
+        if isinstance(result, Exception):
+            logger.error("Index build failed: %s", result)
+
 @app.get("/")
-def root():
+async def root():
     return {"name": "Fashion Commerce API", "status": "ok"}
 
 @app.get("/test")
-def test_database():
+async def test_database(db=Depends(get_db)):
     response = {
         "backend": "✅ Running",
         "database": "❌ Not Available",
@@ -61,7 +215,7 @@ def test_database():
             response["database_name"] = db.name if hasattr(db, 'name') else "✅ Connected"
             response["connection_status"] = "Connected"
             try:
-                collections = db.list_collection_names()
+                collections = await db.list_collection_names()
                 response["collections"] = collections[:10]
                 response["database"] = "✅ Connected & Working"
             except Exception as e:
@@ -75,42 +229,156 @@ def test_database():
 # -----------------
 # Auth (basic demo)
 # -----------------
+SESSION_TTL = 3600
+VERIFIED_CACHE_SIZE = 1024
+
+password_hasher = PasswordHasher()
+
+# Verified against on unknown emails so a miss costs the same argon2 work as a wrong password
+_DUMMY_HASH = password_hasher.hash("")
+
+# (stored hash, sha256 of the attempt) pairs that argon2 already accepted
+_verified: "OrderedDict[tuple, bool]" = OrderedDict()
+
+def _argon2_matches(stored_hash: str, password: str) -> bool:
+    try:
+        return password_hasher.verify(stored_hash, password)
+    except (VerificationError, InvalidHashError):
+        return False
+
+async def verify_password(stored_hash: str, password: str) -> bool:
+    """Check a password against its stored hash, skipping argon2 for recently verified pairs"""
+    if not stored_hash:
+        return False
+    key = (stored_hash, hashlib.sha256(password.encode()).digest())
+    if key in _verified:
+        _verified.move_to_end(key)
+        return True
+    if stored_hash.startswith("$argon2"):
+        if not await run_in_threadpool(_argon2_matches, stored_hash, password):
+            return False
+    elif not secrets.compare_digest(stored_hash.encode(), password.encode()):
+        # Accounts created before hashing stored the raw password
+        return False
+    _verified[key] = True
+    if len(_verified) > VERIFIED_CACHE_SIZE:
+        _verified.popitem(last=False)
+    return True
+
+def session_key(token: str) -> str:
+    return f"session:{token}"
+
 class AuthPayload(BaseModel):
     name: Optional[str] = None
-    email: str
+    email: Email
     password: str
 
 @app.post("/auth/signup")
-def signup(payload: AuthPayload):
-    # Very naive demo: hash-less storage not recommended; we expect password_hash field
-    existing = list(db.user.find({"email": payload.email})) if db else []
+async def signup(payload: AuthPayload, db=Depends(get_db)):
+    existing = await db.user.find_one({"email": payload.email}) if db is not None else None
     if existing:
         raise HTTPException(status_code=400, detail="Email already registered")
-    user = User(name=payload.name or payload.email.split("@")[0], email=payload.email, password_hash=payload.password)
-    user_id = create_document("user", user)
+    password_hash = await run_in_threadpool(password_hasher.hash, payload.password)
+    user = User(name=payload.name or payload.email.split("@")[0], email=payload.email, password_hash=password_hash)
+    try:
+        user_id = await create_document(db, "user", user)
+    except DuplicateKeyError:
+        # Lost a race with a concurrent signup for the same email
+        raise HTTPException(status_code=400, detail="Email already registered")
     return {"id": user_id, "email": user.email, "name": user.name, "role": user.role}
 
 @app.post("/auth/login")
-def login(payload: AuthPayload):
+async def login(payload: AuthPayload, db=Depends(get_db), cache=Depends(get_cache)):
     if db is None:
         raise HTTPException(status_code=500, detail="Database not configured")
-    user = db.user.find_one({"email": payload.email, "password_hash": payload.password})
+    user = await db.user.find_one({"email": payload.email})
     if not user:
+        await run_in_threadpool(_argon2_matches, _DUMMY_HASH, payload.password)
         raise HTTPException(status_code=401, detail="Invalid credentials")
-    user = to_public(user)
-    return {"token": user["id"], "user": {"id": user["id"], "email": user["email"], "name": user.get("name"), "role": user.get("role", "user")}}
+    if not await verify_password(user.get("password_hash", ""), payload.password):
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    if not user["password_hash"].startswith("$argon2") or password_hasher.check_needs_rehash(user["password_hash"]):
+        password_hash = await run_in_threadpool(password_hasher.hash, payload.password)
+        await db.user.update_one({"_id": user["_id"]}, {"$set": {"password_hash": password_hash}})
+    user_id = str(user["_id"])
+    public_user = {"id": user_id, "email": user["email"], "name": user.get("name"), "role": user.get("role", "user")}
+    if cache is None:
+        # No session store: keep the pre-session behavior of handing back the user id
+        return {"token": user_id, "user": public_user}
+    token = secrets.token_urlsafe(32)
+    try:
+        await cache.setex(session_key(token), SESSION_TTL, dumps(public_user))
+    except RedisError:
+        raise HTTPException(status_code=503, detail="Session store unavailable")
+    return {"token": token, "user": public_user}
+
+async def current_user(authorization: Optional[str] = Header(None), cache=Depends(get_cache)) -> Dict[str, Any]:
+    """Resolve a bearer token to its session user from Redis, without touching Mongo"""
+    if cache is None:
+        raise HTTPException(status_code=503, detail="Session store not configured")
+    if not authorization:
+        raise HTTPException(status_code=401, detail="Missing token")
+    scheme, _, token = authorization.partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    try:
+        session = await cache.get(session_key(token))
+    except RedisError:
+        raise HTTPException(status_code=503, detail="Session store unavailable")
+    if session is None:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    return orjson.loads(session)
+
+@app.get("/auth/me")
+async def me(user: Dict[str, Any] = Depends(current_user)):
+    return user
 
 # -----------------
 # Catalog
 # -----------------
+# Only what the listing page renders; full documents come from /products/{id}
+PRODUCT_LIST_FIELDS = {
+    "title": 1,
+    "price": 1,
+    "category": 1,
+    "images": {"$slice": ["$images", 1]},
+    "rating": 1,
+}
+
+# Categories with at least one active product, as seen by this worker. Loaded at startup
+# and extended on demand; it is a per-process fast path only, so misses are confirmed
+# against Mongo with the same is_active rule, since other workers or instances may have
+# written new categories.
+CATEGORIES: frozenset = frozenset()
+
+def register_category(category: Any):
+    global CATEGORIES
+    if isinstance(category, str) and category and category not in CATEGORIES:
+        CATEGORIES = CATEGORIES | {category}
+
+async def load_categories(db):
+    global CATEGORIES
+    CATEGORIES = frozenset(c for c in await db.product.distinct("category", {"is_active": True}) if isinstance(c, str))
+
+async def category_exists(db, category: str) -> bool:
+    if category in CATEGORIES:
+        return True
+    # Served by the (is_active, category, ...) listing index
+    if await db.product.find_one({"category": category, "is_active": True}, {"_id": 1}) is None:
+        return False
+    register_category(category)
+    return True
+
 @app.get("/products")
-def list_products(q: Optional[str] = None, category: Optional[str] = None, size: Optional[str] = None, color: Optional[str] = None, min_price: Optional[float] = None, max_price: Optional[float] = None):
+async def list_products(q: Optional[str] = None, category: Optional[str] = None, size: Optional[str] = None, color: Optional[str] = None, min_price: Optional[float] = None, max_price: Optional[float] = None, db=Depends(get_db), cache=Depends(get_cache)):
     if db is None:
         return []
     query: Dict[str, Any] = {"is_active": True}
     if q:
-        query["title"] = {"$regex": q, "$options": "i"}
+        query["$text"] = {"$search": q}
     if category:
+        if not await category_exists(db, category):
+            raise HTTPException(status_code=400, detail="Unknown category")
         query["category"] = category
     price_filter = {}
     if min_price is not None:
@@ -124,20 +392,43 @@ def list_products(q: Optional[str] = None, category: Optional[str] = None, size:
     if color:
         query["variants.color"] = color
 
-    docs = list(db.product.find(query).limit(60))
-    return [to_public(d) for d in docs]
+    key = product_list_key(query)
+    cached = await cache_get(cache, key)
+    if cached is not None:
+        return json_response(cached)
+
+    # $match stays first so it can use the text/compound indexes
+    pipeline: List[Dict[str, Any]] = [{"$match": query}]
+    if q:
+        pipeline.append({"$sort": {"score": {"$meta": "textScore"}}})
+    pipeline.append({"$limit": 60})
+    pipeline.append({"$project": PRODUCT_LIST_FIELDS})
+    cursor = db.product.aggregate(pipeline)
+    # Pull the first batch before any bytes go out, so query errors surface as a 500
+    # rather than a 200 with a truncated body. With $limit 60 the whole result fits in it.
+    try:
+        first = await cursor.next()
+    except StopAsyncIteration:
+        first = None
+    return StreamingResponse(stream_products(first, cursor, key, cache), media_type="application/json")
 
 @app.get("/products/{product_id}")
-def get_product(product_id: str):
+async def get_product(product_id: str, db=Depends(get_db), cache=Depends(get_cache)):
     if db is None:
         raise HTTPException(status_code=404, detail="Not found")
+    key = product_key(product_id)
+    cached = await cache_get(cache, key)
+    if cached is not None:
+        return json_response(cached)
     try:
-        doc = db.product.find_one({"_id": ObjectId(product_id)})
+        doc = await db.product.find_one({"_id": ObjectId(product_id)})
     except Exception:
         raise HTTPException(status_code=400, detail="Invalid id")
     if not doc:
         raise HTTPException(status_code=404, detail="Not found")
-    return to_public(doc)
+    body = dumps(to_public(doc))
+    await cache_set(cache, key, PRODUCT_TTL, body)
+    return json_response(body)
 
 # -----------------
 # Admin (basic)
@@ -152,55 +443,59 @@ class ProductIn(BaseModel):
     tags: Optional[List[str]] = None
 
 @app.post("/admin/products")
-def admin_create_product(payload: ProductIn):
+async def admin_create_product(payload: ProductIn, db=Depends(get_db), cache=Depends(get_cache)):
     product = Product(**payload.model_dump())
-    new_id = create_document("product", product)
+    new_id = await create_document(db, "product", product)
+    register_category(product.category)
+    await invalidate_products(cache)
     return {"id": new_id}
 
 @app.patch("/admin/products/{product_id}")
-def admin_update_product(product_id: str, payload: Dict[str, Any]):
+async def admin_update_product(product_id: str, payload: Dict[str, Any], db=Depends(get_db), cache=Depends(get_cache)):
     if db is None:
         raise HTTPException(status_code=500, detail="DB not ready")
     try:
-        result = db.product.update_one({"_id": ObjectId(product_id)}, {"$set": payload})
+        result = await db.product.update_one({"_id": ObjectId(product_id)}, {"$set": payload})
     except Exception:
         raise HTTPException(status_code=400, detail="Invalid id")
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Not found")
+    await invalidate_products(cache, product_id)
     return {"updated": True}
 
 @app.delete("/admin/products/{product_id}")
-def admin_delete_product(product_id: str):
+async def admin_delete_product(product_id: str, db=Depends(get_db), cache=Depends(get_cache)):
     if db is None:
         raise HTTPException(status_code=500, detail="DB not ready")
     try:
-        result = db.product.delete_one({"_id": ObjectId(product_id)})
+        result = await db.product.delete_one({"_id": ObjectId(product_id)})
     except Exception:
         raise HTTPException(status_code=400, detail="Invalid id")
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Not found")
+    await invalidate_products(cache, product_id)
     return {"deleted": True}
 
 # -----------------
 # Checkout / Orders
 # -----------------
 class CheckoutPayload(BaseModel):
-    items: List[Dict[str, Any]]
+    items: List[CartItem]
     email: Optional[str] = None
     shipping_address: Dict[str, Any]
     payment_method: str  # stripe or cod
 
 @app.post("/checkout")
-def checkout(payload: CheckoutPayload):
+async def checkout(payload: CheckoutPayload, db=Depends(get_db)):
     if not payload.items:
         raise HTTPException(status_code=400, detail="No items")
-    subtotal = sum(float(i.get("price", 0)) * int(i.get("quantity", 1)) for i in payload.items)
+    subtotal = math.fsum(i.price * i.quantity for i in payload.items)
     shipping = 0.0
     total = round(subtotal + shipping, 2)
 
     order = Order(
         user_id=None,
-        items=payload.items,  # validated loosely
+        items=payload.items,
         subtotal=subtotal,
         shipping=shipping,
         total=total,
@@ -208,7 +503,7 @@ def checkout(payload: CheckoutPayload):
         shipping_address=payload.shipping_address,
         email=payload.email,
     )
-    order_id = create_document("order", order)
+    order_id = await create_document(db, "order", order)
 
     # Stripe integration placeholder: return client secret if needed
     payment = {"method": payload.payment_method}
@@ -223,15 +518,19 @@ def checkout(payload: CheckoutPayload):
 # -----------------
 # Schema Explorer
 # -----------------
+# Models are static, so the schema payload is built once at import
+SCHEMA_BODY = orjson.dumps({
+    "user": User.model_json_schema(),
+    "product": Product.model_json_schema(),
+    "order": Order.model_json_schema(),
+})
+
 @app.get("/schema")
-def schema():
-    return {
-        "user": User.model_json_schema(),
-        "product": Product.model_json_schema(),
-        "order": Order.model_json_schema(),
-    }
+async def schema():
+    return json_response(SCHEMA_BODY)
 
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    workers = int(os.getenv("WEB_CONCURRENCY", os.cpu_count() or 1))
+    uvicorn.run("main:app", host="0.0.0.0", port=port, loop="uvloop", http="httptools", workers=workers, log_level="warning")
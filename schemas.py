@@ -4,15 +4,29 @@ Database Schemas for the Fashion E‑commerce app
 Each Pydantic model corresponds to a MongoDB collection (lowercased class name).
 """
 from __future__ import annotations
-from pydantic import BaseModel, Field, EmailStr
-from typing import List, Optional, Literal, Dict
+import re
+from pydantic import BaseModel, Field, AfterValidator
+from typing import List, Optional, Literal, Dict, Annotated
+
+# -----------------------------
+# Shared field types
+# -----------------------------
+_EMAIL_RE = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
+
+def _check_email(value: str) -> str:
+    if not _EMAIL_RE.fullmatch(value):
+        raise ValueError("value is not a valid email address")
+    return value
+
+# Lightweight stand-in for EmailStr: one precompiled regex, no email-validator
+Email = Annotated[str, AfterValidator(_check_email), Field(json_schema_extra={"format": "email"})]
 
 # -----------------------------
 # Auth / Users
 # -----------------------------
 class User(BaseModel):
     name: str = Field(..., min_length=2, max_length=80)
-    email: EmailStr
+    email: Email
     password_hash: str
     role: Literal["user", "admin"] = "user"
     avatar_url: Optional[str] = None
@@ -71,6 +85,6 @@ class Order(BaseModel):
     payment_status: Literal["pending", "requires_action", "paid", "failed"] = "pending"
     transaction_id: Optional[str] = None
     shipping_address: Address
-    email: Optional[EmailStr] = None
+    email: Optional[Email] = None
 
 # Note: The schema viewer in the studio can inspect these on /schema